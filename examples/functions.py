@@ -1,5 +1,7 @@
 import subprocess
 from datetime import date
+from functools import lru_cache
+from pathlib import Path
 from uuid import uuid4
 
 
@@ -18,7 +20,42 @@ def get_current_date() -> str:
     return date.today().isoformat()
 
 
+def _read_head() -> str | None:
+    """Read the commit hash of HEAD straight from the .git directory
+
+    Returns None if the repository layout isn't one we understand
+    (e.g. worktrees or submodules where .git is a file).
+    """
+    for directory in (Path.cwd(), *Path.cwd().parents):
+        git_dir = directory / ".git"
+        if git_dir.exists():
+            break
+    else:
+        return None
+    if not git_dir.is_dir():
+        return None
+    head = (git_dir / "HEAD").read_text().strip()
+    if not head.startswith("ref: "):
+        return head
+    ref = head.removeprefix("ref: ")
+    ref_file = git_dir / ref
+    if ref_file.is_file():
+        return ref_file.read_text().strip()
+    packed_refs = git_dir / "packed-refs"
+    if packed_refs.is_file():
+        for line in packed_refs.read_text().splitlines():
+            if line.endswith(f" {ref}"):
+                return line.split()[0]
+    return None
+
+
+# the commit won't change during a conversion so only look it up once
+# rather than once per row.
+@lru_cache(maxsize=1)
 def get_short_commit_hash() -> str:
+    commit = _read_head()
+    if commit:
+        return commit[:7]
     cmd = "git rev-parse --short HEAD".split()
     result = subprocess.run(cmd, capture_output=True, text=True, check=True)
     short_hash = result.stdout.strip()
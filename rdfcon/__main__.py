@@ -7,18 +7,19 @@ called from the command line.
 import argparse
 import logging
 import logging.config
-import multiprocessing
+import os
 import webbrowser
 from importlib.metadata import version
 from pathlib import Path
 from pprint import pformat
 
 from rdfcon.config.logs import logging_config
-from rdfcon.convert import convert
-from rdfcon.utils import parse_config_from_yaml
 
 
 def get_spec(path: Path) -> dict:
+    # imported here so that --help, --version and --ui don't pay for rdflib
+    from rdfcon.utils import parse_config_from_yaml
+
     if not path.exists():
         raise FileNotFoundError(f"Spec file could not be found at {path}")
     spec = parse_config_from_yaml(path)
@@ -41,9 +42,21 @@ def main():
         "--processes",
         help="Maximum number of processes, defaults to number of CPU cores -1",
         dest="processes",
-        default=multiprocessing.cpu_count() - 1,
+        default=max(1, (os.cpu_count() or 2) - 1),
         type=int,
     )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        action="store_true",
+        help="Use worker threads instead of worker processes",
+    )
+    parser.add_argument(
+        "--store",
+        help="rdflib store used to serialize turtle/trig output, oxigraph requires oxrdflib",
+        choices=["memory", "oxigraph"],
+        default="memory",
+    )
     parser.add_argument(
         "--ui",
         action="store_true",
@@ -73,7 +86,7 @@ def main():
         parser.error("illegal flag combination, only one of spec or --ui can be given")
 
     assert (
-        0 < args.processes <= multiprocessing.cpu_count()
+        0 < args.processes <= (os.cpu_count() or 1)
     ), "--processes must be between 1 and the number of available cpu cores"
 
     if args.ui:
@@ -82,15 +95,20 @@ def main():
     spec_path = Path(args.spec)
     spec = get_spec(path=spec_path)
 
-    logging.debug("Parsed conversion doc")
-    logging.debug("-" * 80)
-    logging.debug(pformat(spec))
-    logging.debug("-" * 80)
+    if logging.getLogger().isEnabledFor(logging.DEBUG):
+        logging.debug("Parsed conversion doc")
+        logging.debug("-" * 80)
+        logging.debug(pformat(spec))
+        logging.debug("-" * 80)
+
+    from rdfcon.convert import convert
 
     convert(
         spec=spec,
         limit=args.limit,
         processes=args.processes,
+        threads=args.threads,
+        store=args.store,
     )
 
 
@@ -17,9 +17,16 @@ class ColorFormatter(logging.Formatter):
         logging.CRITICAL: red + format_str + reset,
     }
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._formatters = {
+            level: logging.Formatter(fmt=fmt, datefmt=self.datefmt)
+            for level, fmt in self.formats.items()
+        }
+        self._default = logging.Formatter(fmt=self.format_str, datefmt=self.datefmt)
+
     def format(self, record):
-        fmt = self.formats.get(record.levelno, self.format_str)
-        formatter = logging.Formatter(fmt=fmt, datefmt=self.datefmt)
+        formatter = self._formatters.get(record.levelno, self._default)
         return formatter.format(record)
 
 
@@ -3,100 +3,232 @@
 This module uses a conversion schema to process csv data into RDF.
 """
 
-import csv
+import builtins
 import logging
+import math
 import re
-from datetime import datetime
-from functools import partial
-from multiprocessing import Pool
+from collections import Counter, deque
+from contextlib import closing
+from functools import lru_cache
+from itertools import batched, islice
+from multiprocessing import Pool, Process, Queue
+from multiprocessing.pool import ThreadPool
+from pathlib import Path
+from queue import Full
+from typing import Callable
 
 import jinja2
-from rdflib import Dataset, Graph, Literal, Namespace, URIRef
-from rdflib.namespace import RDF
+import jinja2.meta
+from rdflib import BNode, Dataset, Graph, Literal, Namespace, URIRef
+from rdflib.namespace import RDF, NamespaceManager
+from rdflib.term import Node
 from tqdm import tqdm
 
 from rdfcon.custom_functions import load_custom_functions
 from rdfcon.namespace import NSM
 from rdfcon.utils import (
-    approx_size_of,
+    IRI_PATTERN,
     compile_regex,
-    count_rows,
     counter,
+    estimate_rows,
+    get_date_parser,
     get_uuid,
+    read_csv,
     replace_curly_terms,
 )
 
-
-def get_col_values(
-    col: str,
-    separator: str | None,
-    regex: bool,
-    as_iri: bool,
-    datatype: URIRef,
-    datestr: str | None,
-    ns: URIRef | None,
-    as_uuid: bool,
-    ignore_case: bool,
-    label: str | None,
-    ttype: str | None,
-) -> tuple[list[Literal | URIRef], Graph]:
-    g = Graph()
-    col_values = []
-    if col.strip() == "":
-        return col_values, g
-    if separator:
-        if regex:
-            values = compile_regex(separator).split(col)
-        else:
-            values = col.split(separator)
-    else:
-        values = [col]
-    for value in values:
-        stripped = value.strip()
-        if stripped == "":
-            continue
-        if as_iri:
-            iri_str = stripped.strip("<>")
-            if ns is None:
-                try:
-                    iri = URIRef(iri_str)
-                    iri.n3()
-                    col_values.append(iri)
-                except Exception:
-                    raise Exception(f"Could not interpret {iri_str} as an IRI")
-            else:
-                if ignore_case:
-                    iri_str = iri_str.lower()
-                if as_uuid:
-                    iri_str = get_uuid(iri_str)
+# python builtins made available in templates
+TEMPLATE_BUILTINS = {
+    name: getattr(builtins, name)
+    for name in (
+        "abs",
+        "all",
+        "any",
+        "bool",
+        "chr",
+        "dict",
+        "divmod",
+        "enumerate",
+        "filter",
+        "float",
+        "format",
+        "hex",
+        "int",
+        "isinstance",
+        "len",
+        "list",
+        "map",
+        "max",
+        "min",
+        "ord",
+        "pow",
+        "range",
+        "repr",
+        "reversed",
+        "round",
+        "set",
+        "sorted",
+        "str",
+        "sum",
+        "tuple",
+        "zip",
+    )
+}
+# keyword arguments for process_row, set in each worker by _init_worker
+_WORKER_STATE = {}
+# graphs for templates that render the same for every row, by template,
+# prefixes and template format as the parsed graph depends on all three
+_CONSTANT_TEMPLATE_GRAPHS = {}
+# placeholder for bare prefixes, removed after parsing
+NULL_IRI = URIRef("http://null")
+# double quotes, new lines and carriage returns escaped for use inside turtle
+# string literals
+CELL_ESCAPES = str.maketrans({'"': r"\"", "\n": r"\n", "\r": r"\r"})
+# output formats that can be written out piece by piece as rows are converted
+STREAMING_FORMATS = ("nt", "nquads")
+# bytes of n-triples held in memory before being streamed out
+STREAM_BUFFER_SIZE = 16 * 1024 * 1024
+# seconds to wait on a full serializer queue before checking it is still alive
+SERIALIZER_POLL_INTERVAL = 1
+# shared by every spec template so that jinja only sets up its lexer and
+# compiler state once per process
+TEMPLATE_ENV = jinja2.Environment()
+# datatypes on empty string literals, prefixed or full IRIs
+EMPTY_DATATYPE_PATTERN = re.compile(r'""\^\^(?:<[^>]*>|[\w:]+)')
+# empty IRIs
+EMPTY_IRI_PATTERN = re.compile(r"<>")
+# bare prefixes outside of prefix declarations and string literals
+BARE_PREFIX_PATTERN = re.compile(
+    r"^(?!(?:@prefix|prefix))([^\n\"']*?)\b([\w-]+):(?=\s)",
+    flags=re.MULTILINE,
+)
+# keeps the text before a bare prefix and swaps the prefix for NULL_IRI
+BARE_PREFIX_REPLACEMENT = r"\g<1>" + NULL_IRI.n3()
+
+
+# Tabular data tends to repeat the same values (categories, codes, foreign
+# keys etc.) so IRIs and literals are interned rather than rebuilt per cell.
+@lru_cache(maxsize=131072)
+def make_iri(value: str) -> URIRef:
+    if not IRI_PATTERN.fullmatch(value):
+        raise ValueError(f"{value} is not a valid IRI")
+    return URIRef(value)
+
+
+@lru_cache(maxsize=131072)
+def make_namespaced_iri(
+    ns: URIRef, value: str, ignore_case: bool, as_uuid: bool
+) -> URIRef:
+    """Make an IRI for a cell value in a column namespace
+
+    Cached as a whole so that repeated values skip the lower casing and
+    uuid hashing as well as the IRI construction.
+    """
+    if ignore_case:
+        value = value.lower()
+    if as_uuid:
+        value = get_uuid(value)
+    try:
+        return make_iri(ns + value)
+    except Exception:
+        raise Exception(f"Could not interpret {value} as an IRI using namespace {ns}")
+
+
+@lru_cache(maxsize=131072)
+def make_literal(value: str, datatype: URIRef) -> Literal:
+    return Literal(value, datatype=datatype)
+
+
+def get_splitter(separator: str | None, regex: bool) -> Callable[[str], list[str]]:
+    """Get a function that splits a cell into its values"""
+    if not separator:
+        return lambda col: [col]
+    if regex:
+        return compile_regex(separator).split
+    return lambda col: col.split(separator)
+
+
+def get_column_converter(
+    coldef: dict,
+) -> Callable[[str], tuple[list[Literal | URIRef], list[tuple]]]:
+    """Get a function that converts a cell for the given column definition
+
+    The options of the column definition are resolved once here, so that
+    the returned function only does the work needed for that column.
+    It returns the values for the cell along with any extra triples
+    describing them.
+    """
+    split = get_splitter(coldef["separator"], coldef["regex"])
+    datatype = coldef["datatype"]
+
+    if not coldef["as_iri"]:
+        datestr = coldef["datestr"]
+        parse_date = get_date_parser(datestr) if datestr else None
+
+        def convert_literals(col: str) -> tuple[list[Literal], list[tuple]]:
+            if col == "":
+                return [], []
+            col_values = []
+            for value in split(col):
+                stripped = value.strip()
+                if stripped == "":
+                    continue
+                formatted_str = stripped
+                if parse_date:
+                    try:
+                        formatted_str = parse_date(stripped).isoformat()
+                    except Exception:
+                        logging.error(
+                            f"Could not parse {stripped} with datestr: {datestr}"
+                        )
+                        continue
                 try:
-                    iri = URIRef(ns + iri_str)
-                    iri.n3()
-                    col_values.append(iri)
-                except Exception:
-                    raise Exception(
-                        f"Could not interpret {iri_str} as an IRI using namespace {ns}"
+                    col_values.append(make_literal(formatted_str, datatype))
+                except ValueError as e:
+                    logging.error(
+                        f"Could not parse {value} as datatype {datatype}: {e}"
                     )
-            if label:
-                g.add((iri, URIRef(label), Literal(value, datatype=datatype)))
-            if ttype:
-                g.add((iri, RDF.type, URIRef(ttype)))
+            return col_values, []
 
-        else:
-            formatted_str = stripped
-            if datestr:
-                try:
-                    dt = datetime.strptime(stripped, datestr)
-                    formatted_str = dt.isoformat()
-                except Exception:
-                    logging.error(f"Could not parse {stripped} with datestr: {datestr}")
-                    continue
+        return convert_literals
+
+    ns = coldef["namespace"]
+    if ns is None:
+
+        def to_iri(iri_str: str) -> URIRef:
             try:
-                col_values.append(Literal(formatted_str, datatype=datatype))
-            except ValueError as e:
-                logging.error(f"Could not parse {value} as datatype {datatype}: {e}")
+                return make_iri(iri_str)
+            except Exception:
+                raise Exception(f"Could not interpret {iri_str} as an IRI")
+
+    else:
+        ignore_case = coldef["ignore_case"]
+        as_uuid = coldef["as_uuid"]
+
+        def to_iri(iri_str: str) -> URIRef:
+            return make_namespaced_iri(ns, iri_str, ignore_case, as_uuid)
+
+    label = URIRef(coldef["label"]) if coldef["label"] else None
+    ttype = URIRef(coldef["type"]) if coldef["type"] else None
+
+    def convert_iris(col: str) -> tuple[list[URIRef], list[tuple]]:
+        if col == "":
+            return [], []
+        col_values = []
+        triples = []
+        for value in split(col):
+            stripped = value.strip()
+            if stripped == "":
+                continue
+            iri = to_iri(stripped.strip("<>"))
+            col_values.append(iri)
+            if label:
+                triples.append((iri, label, make_literal(value, datatype)))
+            if ttype:
+                triples.append((iri, RDF.type, ttype))
+        return col_values, triples
 
-    return col_values, g
+    return convert_iris
 
 
 def warn_about_unused_columns(headers: list[str], spec: dict, filename: str) -> None:
@@ -106,9 +238,16 @@ def warn_about_unused_columns(headers: list[str], spec: dict, filename: str) ->
     if spec.get("columns"):
         [mapped_columns.add(str(column["column"])) for column in spec["columns"]]
     if spec.get("template"):
-        for col in headers:
-            if re.findall(rf"\{{.*{col}.*\}}", spec["template"]):
-                mapped_columns.add(col)
+        # the text between the first { and last } of each line, a column is
+        # considered mapped if it is referenced anywhere within braces.
+        spans = [
+            line[line.index("{") + 1 : line.rindex("}")]
+            for line in spec["template"].splitlines()
+            if "{" in line and "}" in line
+        ]
+        mapped_columns.update(
+            col for col in headers if any(col in span for span in spans)
+        )
     unmapped_columns = set(headers) - mapped_columns
     if unmapped_columns:
         logging.warning(
@@ -117,6 +256,21 @@ def warn_about_unused_columns(headers: list[str], spec: dict, filename: str) ->
     return
 
 
+def check_column_terms(spec: dict) -> None:
+    """Check the types and predicates of the column mappings are rdflib terms
+
+    Done once up front as the triples are inserted into the store without
+    Graph.addN's per triple checks. CURIEs with unbound prefixes are left
+    as plain strings when the spec is parsed.
+    """
+    for type in spec.get("types") or []:
+        if not isinstance(type, Node):
+            raise ValueError(f"Object {type} must be an rdflib term")
+    for coldef in spec.get("columns") or []:
+        if not isinstance(coldef["predicate"], Node):
+            raise ValueError(f"Predicate {coldef['predicate']} must be an rdflib term")
+
+
 def get_id_column(headers: list[str], spec: dict) -> int | None:
     if spec.get("identifier") is None:
         return None
@@ -127,219 +281,456 @@ def get_id_column(headers: list[str], spec: dict) -> int | None:
     return idcol
 
 
+def get_column_positions(headers: list[str], spec: dict) -> list[int]:
+    # first occurrence wins for duplicated column names, like headers.index
+    header_index = {}
+    for i, header in enumerate(headers):
+        header_index.setdefault(header, i)
+    col_positions = []
+    for coldef in spec.get("columns", []):
+        try:
+            col_positions.append(header_index[str(coldef["column"])])
+        except KeyError:
+            raise ValueError(f"Column '{coldef['column']}' does not exist")
+    return col_positions
+
+
 def get_iri_for_row(row: list, idcol: int, ns: URIRef) -> URIRef | None:
     if idcol is None or row[idcol] == "":
         return None
     if ns:
         iri = ns[str(row[idcol])]
     else:
-        try:
-            iri = URIRef(row[idcol].strip("<>"))
-            iri.n3()
-        except Exception:
+        value = row[idcol].strip("<>")
+        if not IRI_PATTERN.fullmatch(value):
             raise Exception(f"Could not interpret {row[idcol]} as an IRI")
+        iri = URIRef(value)
     return iri
 
 
-def row_to_graph(headers: list[str], spec: dict, iri: URIRef, row: list) -> Graph:
-    g = Graph()
+def columns_to_triples(
+    col_positions: list[int],
+    converters: list[Callable],
+    spec: dict,
+    iris: list[URIRef],
+    rows: list[list],
+) -> list[tuple]:
+    """Apply the column mappings to a batch of rows
+
+    Works through one column at a time across all of the rows, using the
+    converter built for each column by get_column_converter.
+    """
+    triples = []
 
     # type declarations
     if spec.get("types"):
         for type in spec["types"]:
-            g.add((iri, RDF.type, type))
+            triples.extend((iri, RDF.type, type) for iri in iris)
 
     # column conversions
-    for coldef in spec.get("columns", []):
-        col = headers.index(str(coldef["column"]))
-        col_values, graph = get_col_values(
-            col=row[col],
-            separator=coldef["separator"],
-            regex=coldef["regex"],
-            datatype=coldef["datatype"],
-            datestr=coldef["datestr"],
-            as_iri=coldef["as_iri"],
-            ns=coldef["namespace"],
-            as_uuid=coldef["as_uuid"],
-            ignore_case=coldef["ignore_case"],
-            label=coldef["label"],
-            ttype=coldef["type"],
-        )
-        for col_value in col_values:
-            g.add((iri, coldef["predicate"], col_value))
-        g += graph
+    for col, convert_cell, coldef in zip(
+        col_positions, converters, spec.get("columns", [])
+    ):
+        predicate = coldef["predicate"]
+        for iri, row in zip(iris, rows):
+            col_values, extra_triples = convert_cell(row[col])
+            triples.extend((iri, predicate, col_value) for col_value in col_values)
+            triples.extend(extra_triples)
+
+    return triples
+
+
+@lru_cache(maxsize=128)
+def get_template(
+    template_str: str, prefixes: str, template_functions: Path | None
+) -> jinja2.Template:
+    """Compile the jinja template for a spec
+
+    Cached so that the template is only compiled once per process
+    rather than once per row.
+    """
+    # add custom functions and python builtins to the template context
+    custom_functions = load_custom_functions(template_functions)
+    return TEMPLATE_ENV.from_string(
+        prefixes + replace_curly_terms(template_str),
+        globals={**TEMPLATE_BUILTINS, **custom_functions},
+    )
 
-    return g
+
+@lru_cache(maxsize=128)
+def is_constant_template(template_str: str) -> bool:
+    """Whether a template renders the same for every row
+
+    True when the template doesn't reference any variables at all, not
+    even the row or a custom function.
+    """
+    ast = TEMPLATE_ENV.parse(replace_curly_terms(template_str))
+    return not jinja2.meta.find_undeclared_variables(ast)
 
 
 def templated_expressions(
     headers: list[str],
     row: list,
     spec: dict,
-    idcol: int,
 ) -> Graph:
+    constant = is_constant_template(spec["template"])
+    if constant:
+        key = (
+            spec["template"],
+            spec.get("prefixes"),
+            spec.get("templateFormat", "turtle"),
+        )
+        if key in _CONSTANT_TEMPLATE_GRAPHS:
+            return _CONSTANT_TEMPLATE_GRAPHS[key]
 
     g = Graph()
-
-    # escape double quotes in strings
-    row = [cell.replace('"', r"\"") for cell in row]
-    # escape new lines
-    row = [cell.replace("\n", r"\n") for cell in row]
-    r = {col: row[headers.index(col)] for col in headers}
-    template_str = spec.get("prefixes", "") + replace_curly_terms(spec["template"])
-    template = jinja2.Template(template_str)
-    # add custom functions and python builtins to the template context
-    custom_functions = load_custom_functions(spec.get("templateFunctions"))
-    template.globals.update(custom_functions)
-    template.globals.update(__builtins__)
+    # n-triples templates use full IRIs only, so need no prefix front matter
+    ntriples = spec.get("templateFormat", "turtle") == "nt"
+
+    # escape double quotes, new lines and carriage returns in strings
+    row = [cell.translate(CELL_ESCAPES) for cell in row]
+    # built back to front so a duplicated column name refers to its first
+    # occurrence, like headers.index would
+    r = dict(reversed(list(zip(headers, row))))
+    template = get_template(
+        template_str=spec["template"],
+        prefixes="" if ntriples else spec.get("prefixes", ""),
+        template_functions=spec.get("templateFunctions"),
+    )
     try:
         rendered = template.render(r=r, row=row, headers=headers)
     except Exception as e:
-        raise Exception(f"Could not render the template string\n{template_str}: {e}")
+        raise Exception(
+            f"Could not render the template string\n{spec['template']}: {e}"
+        )
     # remove datatypes from empty string literals to avoid parser warnings
-    rendered = re.sub(r'""\^\^[\w:]+', '""', rendered)
+    rendered = EMPTY_DATATYPE_PATTERN.sub('""', rendered)
     # replace empty IRIs with empty strings so they can be removed
-    rendered = re.sub(r"<>", '""', rendered)
+    rendered = EMPTY_IRI_PATTERN.sub('""', rendered)
     # replace bare prefixes with a placeholder IRI so they can be removed
-    rendered = re.sub(
-        r"^(?!(?:@prefix|prefix))([^\n\"']*?)\b([\w-]+):(?=\s)",
-        lambda m: m.group(1) + "<http://null>",
-        rendered,
-        flags=re.MULTILINE,
-    )
+    if not ntriples:
+        rendered = BARE_PREFIX_PATTERN.sub(BARE_PREFIX_REPLACEMENT, rendered)
 
     try:
-        g += Graph().parse(data=rendered, format="turtle")
+        g.parse(data=rendered, format="nt" if ntriples else "turtle")
     except Exception as e:
         raise Exception(
             f"Could not parse rendered template expression\n{rendered}: {e}"
         )
 
-    # remove empty literals from the graph
-    empty_literals = g.query(
-        "select ?s ?p ?o where { ?s ?p ?o . filter(str(?o) = '') }"
-    )
-    for s, p, o in empty_literals:
-        g.remove((s, p, o))
-
-    # remove null IRI placeholders
-    null_triples = (triple for triple in g if URIRef("http://null") in triple)
-    for triple in null_triples:
-        g.remove(triple)
+    # remove empty literals and null IRI placeholders from the graph
+    for s, p, o in list(g):
+        if (isinstance(o, Literal) and str(o) == "") or NULL_IRI in (s, p, o):
+            g.remove((s, p, o))
 
-    # recursively remove empty blank nodes from the graph
-    empty_bnode_query = "select ?o where { ?s ?p ?o . filter(isblank(?o)) . filter not exists { ?o ?x ?y } }"
-    empty_bnodes = g.query(empty_bnode_query)
+    # remove empty blank nodes from the graph, along with any blank nodes
+    # that are left empty by doing so, in a single pass
+    statement_counts = Counter(s for s in g.subjects() if isinstance(s, BNode))
+    empty_bnodes = deque(
+        {o for o in g.objects() if isinstance(o, BNode) and o not in statement_counts}
+    )
     while empty_bnodes:
-        for o in empty_bnodes:
-            g.remove((None, None, o))
-            empty_bnodes = g.query(empty_bnode_query)
-
+        bnode = empty_bnodes.popleft()
+        for s, p in list(g.subject_predicates(bnode)):
+            g.remove((s, p, bnode))
+            if isinstance(s, BNode):
+                statement_counts[s] -= 1
+                if statement_counts[s] == 0:
+                    empty_bnodes.append(s)
+
+    # blank nodes have to be minted fresh for each row
+    if constant and not any(isinstance(node, BNode) for node in g.all_nodes()):
+        _CONSTANT_TEMPLATE_GRAPHS[key] = g
     return g
 
 
-def process_row(
-    row: list,
+def process_rows(
+    rows: list[list],
     idcol: int,
     headers: list,
+    col_positions: list[int],
     ns: Namespace,
     spec: dict,
-) -> Graph:
-    g = Graph()
+    converters: list[Callable],
+) -> bytes:
+    """Convert a batch of rows to RDF
+
+    The result is returned as n-triples rather than a Graph as it is much
+    cheaper to pickle back to the main process.
+    """
+    triples = []
     if spec.get("columns"):
-        iri = get_iri_for_row(row, idcol, ns)
-        g += row_to_graph(headers=headers, spec=spec, iri=iri, row=row)
-    if spec.get("template"):
-        g += templated_expressions(
-            headers=headers,
+        # rows without an identifier have no subject for the column mappings
+        iris = []
+        identified_rows = []
+        for row in rows:
+            iri = get_iri_for_row(row, idcol, ns)
+            if iri is not None:
+                iris.append(iri)
+                identified_rows.append(row)
+        if len(identified_rows) < len(rows):
+            logging.warning(
+                f"Skipped the column mappings for {len(rows) - len(identified_rows)} rows without an identifier"
+            )
+        triples = columns_to_triples(
+            col_positions=col_positions,
+            converters=converters,
             spec=spec,
-            row=row,
-            idcol=idcol,
+            iris=iris,
+            rows=identified_rows,
         )
-    return g
+    if spec.get("template"):
+        for row in rows:
+            graph = templated_expressions(headers=headers, spec=spec, row=row)
+            triples.extend(graph)
+    # a single bulk insert straight into the store, skipping the per triple
+    # checks Graph.addN does, which also drops duplicate triples
+    g = Graph()
+    g.store.addN((s, p, o, g) for s, p, o in triples)
+    return g.serialize(format="nt", encoding="utf-8")
+
+
+def _init_worker(state: dict) -> None:
+    """Store the state shared by every row in the worker process
+
+    Run once per worker by the Pool so that the spec and headers aren't
+    pickled and sent along with every batch of rows. The column
+    converters are built here too, as closures can't be pickled.
+    """
+    _WORKER_STATE.update(state)
+    _WORKER_STATE["converters"] = [
+        get_column_converter(coldef) for coldef in state["spec"].get("columns", [])
+    ]
+
+
+def _process_rows_in_worker(rows: tuple[list, ...]) -> tuple[int, bytes]:
+    """Convert a batch of rows to n-triples
+
+    Returns the number of rows processed along with the n-triples so that
+    only one result per batch is pickled back to the main process.
+    """
+    return len(rows), process_rows(rows=rows, **_WORKER_STATE)
+
+
+def ntriples_to_nquads(data: bytes, graph_name: str) -> bytes:
+    """Put every statement of an n-triples document into the named graph"""
+    # the graph name is a plain string when the spec used an IRI scheme that
+    # isn't a bound prefix, e.g. urn:, which Dataset.graph accepts as well
+    graph = URIRef(graph_name).n3()
+    # n-triples statements always end with " .\n", literals can't contain a
+    # raw new line.
+    return data.replace(b" .\n", f" {graph} .\n".encode("utf-8"))
+
+
+def serialize_chunks(
+    queue: Queue, namespaces: list[tuple[str, URIRef]], store: str = "memory"
+) -> None:
+    """Serialize chunks of output in a separate process
+
+    Chunks are put on the queue as n-triples along with the graph name,
+    destination and format. Serializing to turtle/trig is slow, doing it
+    here lets the main process carry on consuming rows in the meantime.
+    n-triples and n-quads are written out as is without parsing, and may
+    arrive in several pieces which are appended to the same destination.
+    With the oxigraph store turtle/trig chunks are parsed and serialized
+    by oxigraph instead of rdflib.
+    A None on the queue signals that there are no more chunks.
+    """
+    nsm = NamespaceManager(Graph(), bind_namespaces="none")
+    for prefix, namespace in namespaces:
+        nsm.bind(prefix, namespace)
+    started = set()
+    for data, graph_name, destination, format in iter(queue.get, None):
+        if format in STREAMING_FORMATS:
+            if format == "nquads":
+                data = ntriples_to_nquads(data, graph_name)
+            with open(destination, "ab" if destination in started else "wb") as f:
+                f.write(data)
+            started.add(destination)
+            continue
+        if store == "oxigraph":
+            # the ox- parsers only load into a named graph via n-quads
+            if graph_name:
+                g = Dataset(store="Oxigraph")
+                data = ntriples_to_nquads(data, graph_name)
+            else:
+                g = Graph(store="Oxigraph")
+            g.namespace_manager = nsm
+            g.parse(data=data, format="ox-nquads" if graph_name else "ox-ntriples")
+            g.serialize(destination=destination, format=f"ox-{format}")
+            continue
+        g = Dataset().graph(graph_name)
+        g.namespace_manager = nsm
+        g.parse(data=data, format="nt")
+        g.serialize(destination=destination, format=format)
+
+
+def put_for_serializer(queue: Queue, serializer: Process, item, outdir: Path) -> None:
+    """Put an item on the serializer's queue
+
+    The queue is bounded, so a plain put would wait forever once the
+    serializer has died. Raises if it has.
+    """
+    while True:
+        try:
+            queue.put(item, timeout=SERIALIZER_POLL_INTERVAL)
+            return
+        except Full:
+            if not serializer.is_alive():
+                # nothing will read what is left in the queue, don't wait
+                # to flush it on exit
+                queue.cancel_join_thread()
+                raise RuntimeError(f"Failed to serialize output to {outdir}")
+
+
+def queue_chunk(
+    queue: Queue,
+    serializer: Process,
+    buffer: list[bytes],
+    graph_name: URIRef | None,
+    destination: Path,
+    format: str,
+) -> int:
+    """Queue a chunk of n-triples for serialization
+
+    Returns the number of statements in the chunk.
+    """
+    data = b"".join(buffer)
+    put_for_serializer(
+        queue, serializer, (data, graph_name, destination, format), destination.parent
+    )
+    return data.count(b"\n")
 
 
-def convert(spec: dict, limit: int, processes: int) -> None:
+def convert(
+    spec: dict,
+    limit: int,
+    processes: int,
+    threads: bool = False,
+    store: str = "memory",
+) -> None:
+    if store == "oxigraph":
+        # imported here so that conversions with the memory store don't pay
+        # for it, rdflib finds the Oxigraph store and ox- plugins by itself
+        try:
+            import oxrdflib  # noqa: F401
+        except ImportError:
+            logging.warning("oxrdflib is not installed, using the memory store instead")
+            store = "memory"
     graph_name = spec.get("graph")
-    d = Dataset()
-    g = d.graph(graph_name)
-    g.namespace_manager = NSM
+    statements = "quads" if graph_name else "triples"
     if graph_name:
-        outfile = (spec["outdir"] / spec["infile"].with_suffix(".trig").name).resolve()
-        format = "trig"
+        suffix, format = (
+            (".nq", "nquads") if spec.get("fastSerialize") else (".trig", "trig")
+        )
     else:
-        outfile = (spec["outdir"] / spec["infile"].with_suffix(".ttl").name).resolve()
-        format = "turtle"
+        suffix, format = (
+            (".nt", "nt") if spec.get("fastSerialize") else (".ttl", "turtle")
+        )
+    outfile = (spec["outdir"] / spec["infile"].with_suffix(suffix).name).resolve()
     ns = Namespace(spec["namespace"]) if spec.get("namespace") else None
-    total = count_rows(infile=spec["infile"], encoding=spec["encoding"]) - 1
-    if limit <= 0 or total < limit:
-        limit = total
-    row_counter = counter()
+    # only used to size the progress bar and the row batches
+    total = max(1, estimate_rows(spec["infile"]) - 1)
+    if limit > 0:
+        total = min(total, limit)
+    else:
+        limit = None
+    max_size = spec.get("maxGraphSizeMb")
+    size_check_frequency = spec["sizeCheckFrequency"]
+    rows_since_size_check = 0
     chunk_counter = counter()
+    chunk = next(chunk_counter)
     total_triples = 0
     total_size = 0
-    with open(spec["infile"], "r", encoding=spec["encoding"]) as file:
-        reader = csv.reader(file)
+    # n-triples for the current chunk not yet handed to the serializer
+    buffer = []
+    buffer_size = 0
+    # n-triples for the current chunk already handed to the serializer
+    chunk_size = 0
+    chunk_triples = 0
+    chunks = Queue(maxsize=2)
+    serializer = Process(
+        target=serialize_chunks,
+        args=(chunks, list(NSM.namespaces()), store),
+        daemon=True,
+    )
+    serializer.start()
+
+    def flush(final: bool) -> None:
+        """Hand the buffer to the serializer, finishing the chunk if final"""
+        nonlocal chunk, buffer, buffer_size, chunk_size, chunk_triples
+        nonlocal total_size, total_triples
+        if buffer:
+            chunk_triples += queue_chunk(
+                queue=chunks,
+                serializer=serializer,
+                buffer=buffer,
+                graph_name=graph_name,
+                destination=outfile.with_stem(f"{outfile.stem}-{chunk}"),
+                format=format,
+            )
+            chunk_size += buffer_size
+            buffer = []
+            buffer_size = 0
+        if final and chunk_size:
+            size = math.floor(chunk_size / 1024 / 1024)
+            total_size += size
+            total_triples += chunk_triples
+            logging.info(
+                f"Serializing chunk {chunk}, ~ {size}Mb, {chunk_triples:,} {statements}"
+            )
+            chunk = next(chunk_counter)
+            chunk_size = 0
+            chunk_triples = 0
+
+    with closing(read_csv(infile=spec["infile"], encoding=spec["encoding"])) as reader:
         headers = next(reader)
         warn_about_unused_columns(
             headers=headers, spec=spec, filename=spec["infile"].name
         )
-        idcol = get_id_column(headers, spec)
-        worker = partial(
-            process_row,
-            idcol=idcol,
-            headers=headers,
-            ns=ns,
-            spec=spec,
-        )
-        with Pool(processes=processes) as pool:
-            results = tqdm(
-                pool.imap_unordered(worker, reader, chunksize=1),
-                total=limit,
-                initial=1,
+        check_column_terms(spec)
+        state = {
+            "idcol": get_id_column(headers, spec),
+            "headers": headers,
+            "col_positions": get_column_positions(headers, spec),
+            "ns": ns,
+            "spec": spec,
+        }
+        # threads share the state and caches directly, avoiding pickling and
+        # worker start up, at the cost of running under the GIL
+        pool_class = ThreadPool if threads else Pool
+        with pool_class(
+            processes=processes, initializer=_init_worker, initargs=(state,)
+        ) as pool:
+            # rows are sent to the workers in contiguous batches, large
+            # enough to amortize the pickling but leaving each worker
+            # plenty of batches to balance the load.
+            batch_size = max(32, total // (processes * 64))
+            results = pool.imap_unordered(
+                _process_rows_in_worker, batched(islice(reader, limit), batch_size)
             )
-            for result in results:
-                g += result
-                i = next(row_counter)
-                if i >= limit:
-                    chunk = next(chunk_counter)
-                    size = approx_size_of(g)
-                    total_size += size
-                    num_triples = len(g)
-                    total_triples += num_triples
-                    logging.info(
-                        f"Serializing chunk {chunk}, ~ {size}Mb, {num_triples:,} {'quads' if graph_name else 'triples'}"
-                    )
-                    g.serialize(
-                        destination=outfile.with_stem(f"{outfile.stem}-{chunk}"),
-                        format=format,
-                    )
-                    break
-                if spec.get("maxGraphSizeMb"):
-                    if i % spec["sizeCheckFrequency"] == 0:
-                        num_triples = len(g)
-                        total_triples += num_triples
-                        size = approx_size_of(g)
-                        total_size += size
-                        logging.info(
-                            f"Current graph size ~ {size}Mb, {num_triples:,} {'quads' if graph_name else 'triples'}"
-                        )
-                        if size > spec["maxGraphSizeMb"]:
-                            chunk = next(chunk_counter)
-                            logging.info(
-                                f"Serializing chunk {chunk}, ~ {size}Mb, {num_triples:,} {'quads' if graph_name else 'triples'}"
-                            )
-                            g.serialize(
-                                destination=outfile.with_stem(
-                                    f"{outfile.stem}-{chunk}"
-                                ),
-                                format=format,
-                            )
-                            del d
-                            d = Dataset()
-                            g = d.graph(graph_name)
-                            g.namespace_manager = NSM
+            progress = tqdm(total=total)
+            for num_rows, result in results:
+                progress.update(num_rows)
+                buffer.append(result)
+                buffer_size += len(result)
+                rows_since_size_check += num_rows
+                if format in STREAMING_FORMATS and buffer_size >= STREAM_BUFFER_SIZE:
+                    flush(final=False)
+                if max_size and rows_since_size_check >= size_check_frequency:
+                    rows_since_size_check = 0
+                    size = math.floor((chunk_size + buffer_size) / 1024 / 1024)
+                    logging.info(f"Current graph size ~ {size}Mb")
+                    if size > max_size:
+                        flush(final=True)
+            progress.close()
+    flush(final=True)
+    put_for_serializer(chunks, serializer, None, spec["outdir"])
+    serializer.join()
+    if serializer.exitcode != 0:
+        chunks.cancel_join_thread()
+        raise RuntimeError(f"Failed to serialize output to {spec['outdir']}")
     logging.info(
-        f"~ {total_size}Mb, {total_triples:,} {'quads' if graph_name else 'triples'} written to {spec['outdir']}"
+        f"~ {total_size}Mb, {total_triples:,} {statements} written to {spec['outdir']}"
     )
     return
@@ -5,7 +5,7 @@ from functools import lru_cache
 
 
 def _list_functions_in_file(filename: str):
-    with open(filename, "r") as f:
+    with open(filename, "rb") as f:
         tree = ast.parse(f.read(), filename=filename)
     return [node.name for node in ast.walk(tree) if isinstance(node, ast.FunctionDef)]
 
@@ -51,6 +51,11 @@ md_schema = {
         "default": 30000,
         "min": 1,
     },
+    "fastSerialize": {
+        "type": "boolean",
+        "required": False,
+        "default": False,
+    },
     "graph": {"type": "string", "required": False},
     "namespace": {
         "type": "string",
@@ -110,5 +115,9 @@ md_schema = {
         "nullable": True,
         "regex": r".*\.py$",
     },
+    "templateFormat": {
+        "type": "string",
+        "allowed": ["turtle", "nt"],
+    },
     "template": {"type": "string", "default": None, "nullable": True},
 }
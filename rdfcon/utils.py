@@ -3,17 +3,18 @@
 general utility functions to be used in other modules
 """
 
+import codecs
 import csv
 import functools
+import hashlib
+import itertools
 import logging
-import math
-import pickle
 import re
 import time
 import uuid
-from copy import deepcopy
+from datetime import datetime
 from pathlib import Path
-from typing import Iterator
+from typing import Callable, Iterator
 
 import cerberus
 import yaml
@@ -22,6 +23,11 @@ from rdflib import URIRef
 from rdfcon.namespace import NSM
 from rdfcon.schemas import md_schema
 
+try:
+    import polars as pl
+except ImportError:
+    pl = None
+
 
 def timer(func):
     @functools.wraps(func)
@@ -35,9 +41,17 @@ def timer(func):
     return wrapped
 
 
-@functools.lru_cache(maxsize=128)
+# uuids by the value they were made from, cleared when it grows too large
+UUID_CACHE: dict[str, str] = {}
+UUID_CACHE_SIZE = 262144
+
+
 def get_uuid(value: str) -> str:
-    new_uuid = str(uuid.uuid5(uuid.NAMESPACE_DNS, value))
+    new_uuid = UUID_CACHE.get(value)
+    if new_uuid is None:
+        if len(UUID_CACHE) >= UUID_CACHE_SIZE:
+            UUID_CACHE.clear()
+        new_uuid = UUID_CACHE[value] = str(uuid.uuid5(uuid.NAMESPACE_DNS, value))
     return new_uuid
 
 
@@ -46,54 +60,335 @@ def compile_regex(pattern: str) -> re.Pattern:
     return re.compile(pattern=pattern)
 
 
+# datestr formats that datetime.fromisoformat can parse
+ISO_DATE_FORMATS = {
+    "%Y-%m-%d",
+    "%Y-%m-%dT%H:%M",
+    "%Y-%m-%dT%H:%M:%S",
+    "%Y-%m-%d %H:%M",
+    "%Y-%m-%d %H:%M:%S",
+}
+
+
+# the libyaml based loader is much faster, but only exists if PyYAML was
+# built against libyaml (the published wheels are)
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+
+# parsed imported specs along with the digests of the spec files they were
+# made from, see parse_config_from_yaml
+IMPORTED_SPECS: dict[tuple, tuple[dict, dict[Path, bytes]]] = {}
+
+# imported specs are validated without requiring an infile
+IMPORTED_SCHEMA = {**md_schema, "infile": {**md_schema["infile"], "required": False}}
+
+# building a validator normalizes its schema, so they are only built once.
+# each spec is validated and normalized before its imports are parsed, so
+# the recursion never uses a validator while it is still in use
+SPEC_VALIDATOR = cerberus.Validator(md_schema)
+IMPORTED_SPEC_VALIDATOR = cerberus.Validator(IMPORTED_SCHEMA)
+
+# one shared object per IRI used in a spec, so that repeated predicates and
+# types hash and compare by identity
+SPEC_IRIS: dict[URIRef, URIRef] = {}
+
+# single curly braces that are NOT for Jinja-like {% ... %} tags
+CURLY_TERM_PATTERN = re.compile(r"(?<!\{)\{(?!%)([^{}]+?)(?<!%)\}(?!\})")
+CURLY_TERM_REPLACEMENT = r"{{ r['\1'] }}"
+
+# characters rdflib refuses to serialize in an IRI (rdflib.term._invalid_uri_chars)
+IRI_PATTERN = re.compile(r'[^<>" {}|\\^`]*')
+
+# the patterns strptime uses for the numeric directives
+NUMERIC_DATE_DIRECTIVES = {
+    "d": r"(?P<d>3[01]|[12]\d|0[1-9]|[1-9]| [1-9])",
+    "m": r"(?P<m>1[0-2]|0[1-9]|[1-9])",
+    "Y": r"(?P<Y>\d\d\d\d)",
+    "y": r"(?P<y>\d\d)",
+    "H": r"(?P<H>2[0-3]|[0-1]\d|\d)",
+    "M": r"(?P<M>[0-5]\d|\d)",
+    "S": r"(?P<S>6[0-1]|[0-5]\d|\d)",
+}
+
+
+def compile_date_format(datestr: str) -> re.Pattern | None:
+    """Compile a date format made up of numeric directives to a regex
+
+    Returns None if the format uses any other directive (month names,
+    time zones etc.) or repeats one.
+    """
+    parts = []
+    seen = set()
+    for i, part in enumerate(datestr.split("%")):
+        if i == 0:
+            directive, literal = "", part
+        elif part == "":
+            # %% is a literal %
+            return None
+        else:
+            directive, literal = part[0], part[1:]
+        if directive:
+            if directive not in NUMERIC_DATE_DIRECTIVES or directive in seen:
+                return None
+            seen.add(directive)
+            parts.append(NUMERIC_DATE_DIRECTIVES[directive])
+        # strptime matches any run of whitespace in the format loosely
+        parts.extend(
+            r"\s+" if chunk.isspace() else re.escape(chunk)
+            for chunk in re.split(r"(\s+)", literal)
+            if chunk
+        )
+    return re.compile("".join(parts), flags=re.IGNORECASE)
+
+
+@functools.lru_cache(maxsize=128)
+def get_date_parser(datestr: str) -> Callable[[str], datetime]:
+    """Return a function that parses dates in the given format
+
+    strptime is slow, so ISO formats are parsed with the C implemented
+    fromisoformat instead. The result is only used if it formats back to
+    the original value, otherwise (e.g. unpadded days or months) it falls
+    back to strptime so the accepted values are the same either way.
+    Other formats made up of numeric directives are matched with the same
+    regex strptime would build, and the datetime built from the groups.
+    """
+
+    def strptime(value: str) -> datetime:
+        return datetime.strptime(value, datestr)
+
+    def fromisoformat(value: str) -> datetime:
+        try:
+            dt = datetime.fromisoformat(value)
+        except ValueError:
+            return strptime(value)
+        if dt.strftime(datestr) != value:
+            return strptime(value)
+        return dt
+
+    def from_pattern(value: str) -> datetime:
+        match = pattern.fullmatch(value)
+        if match is None:
+            return strptime(value)
+        fields = match.groupdict()
+        if "y" in fields:
+            # the same pivot strptime uses for two digit years
+            year = int(fields["y"])
+            year += 1900 if year >= 69 else 2000
+        else:
+            year = int(fields.get("Y", 1900))
+        try:
+            return datetime(
+                year,
+                int(fields.get("m", 1)),
+                int(fields.get("d", 1)),
+                int(fields.get("H", 0)),
+                int(fields.get("M", 0)),
+                int(fields.get("S", 0)),
+            )
+        except ValueError:
+            return strptime(value)
+
+    if datestr in ISO_DATE_FORMATS:
+        return fromisoformat
+    pattern = compile_date_format(datestr)
+    if pattern is None:
+        return strptime
+    return from_pattern
+
+
 @timer
-def count_rows(infile: Path, encoding: str) -> int:
+def estimate_rows(infile: Path, sample_size: int = 1024 * 1024) -> int:
+    """Estimate the number of rows in a CSV file, including the header
+
+    Extrapolates the number of lines in the first sample_size bytes over
+    the size of the file, so that the whole file doesn't have to be read
+    just to size a progress bar. Cells with new lines in them are counted
+    as more than one row.
+    """
+    size = infile.stat().st_size
+    with open(infile, "rb") as f:
+        sample = f.read(sample_size)
+    lines = sample.count(b"\n")
+    if len(sample) == size:
+        # the whole file, allowing for no trailing new line
+        return lines + (not sample.endswith(b"\n") and size > 0)
+    return max(1, size * lines // len(sample))
+
+
+def read_csv(infile: Path, encoding: str) -> Iterator[list[str]]:
+    """Yield the rows of a CSV file, starting with the header row
+
+    Uses the polars CSV reader when polars is installed and the file is
+    utf-8 encoded (the only encoding polars supports), otherwise falls
+    back to the standard library csv reader. Either way every cell is a
+    string, with missing values as empty strings.
+
+    The header row always comes from the csv reader, as polars would drop
+    a byte order mark and rename duplicate column names. The polars rows
+    are cut or padded with empty strings to the width of the header, the
+    csv reader rows are left as they are in the file. Windows and old Mac
+    line endings in quoted cells become plain new lines with either, as
+    the csv reader reads with universal newlines.
+    """
+    if pl is None or codecs.lookup(encoding).name != "utf-8":
+        with open(infile, "r", encoding=encoding) as f:
+            yield from csv.reader(f)
+        return
     with open(infile, "r", encoding=encoding) as f:
-        return sum(1 for _ in csv.reader(f))
+        yield next(csv.reader(f), [])
+    lf = pl.scan_csv(
+        infile,
+        infer_schema=False,
+        empty_string_is_null=False,
+        truncate_ragged_lines=True,
+    ).with_columns(
+        pl.all()
+        .str.replace_all("\r\n", "\n", literal=True)
+        .str.replace_all("\r", "\n", literal=True)
+    )
+    for df in lf.collect_batches():
+        yield from map(list, df.fill_null("").iter_rows())
 
 
 def resolve_path(path_str: str, spec_path: Path, directory: bool = False) -> Path:
     path = Path(path_str)
     if not path.is_absolute():
-        path = (spec_path.parent / path).resolve()
+        path = spec_path.parent / path
+    path = path.resolve()
     if not path.exists():
         raise FileNotFoundError(f"Could not find the file {path}")
     if not directory and path.is_dir():
         raise ValueError(f"{path} is a directory")
     elif directory and path.is_file():
         raise ValueError(f"{path} is a file")
-    return path.resolve()
+    return path
 
 
 def merge(base: dict, new: dict) -> dict:
-    """Merge two dictionaries but smarter than .update"""
-    merged = {}
-    for k, new_value in new.items():
-        old_value = base.get(k)
-        if isinstance(old_value, dict) and isinstance(new_value, dict):
-            merged[k] = merge(old_value, new_value)
-        elif new_value:
-            merged[k] = new_value
-        elif old_value:
-            merged[k] = old_value
-    return merged
+    """Merge new into base in place but smarter than .update
 
+    Nested dictionaries are merged key by key and empty values in new
+    don't overwrite the values in base. Returns base.
+    """
+    stack = [(base, new)]
+    while stack:
+        old, new = stack.pop()
+        for k, new_value in new.items():
+            old_value = old.get(k)
+            if isinstance(old_value, dict) and isinstance(new_value, dict):
+                stack.append((old_value, new_value))
+            elif new_value:
+                old[k] = new_value
+    return base
+
+
+@functools.lru_cache(maxsize=4096)
+def resolve_iri(iri: str) -> URIRef | None:
+    """Make a URIRef from a full IRI, or None if rdflib can't serialize it
+
+    Unlike CURIEs these don't depend on the bound prefixes, so they are
+    cached across all the specs that get parsed.
+    """
+    if IRI_PATTERN.fullmatch(iri):
+        return URIRef(iri)
+    return None
 
-@timer
-def parse_config_from_yaml(spec: Path, imported: bool = False) -> dict:
-    logging.debug(f"Parsing config from {spec.name}")
-    with open(spec, "r") as file:
-        try:
-            this_spec = yaml.safe_load(file)
-        except yaml.YAMLError as e:
-            logging.error(f"Error loading {spec.name}: {e}")
 
-    if imported:
-        schema = deepcopy(md_schema)
-        schema["infile"]["required"] = False
+def resolve_str(value: str) -> str | URIRef:
+    """Resolve an IRI or CURIE to a URIRef, returning other strings as is"""
+    # unwrap a single <...> pair, anything else is left for the checks below
+    if value.startswith("<") and value.endswith(">"):
+        x = value[1:-1]
     else:
-        schema = md_schema
-    v = cerberus.Validator(schema)
+        x = value
+    if x.startswith("http"):
+        value = resolve_iri(x) or value
+    # same as NSM.expand_curie, but checks the prefix is bound rather than
+    # raising for the free text values that make up most of a spec
+    elif ":" in x:
+        prefix, _, reference = x.partition(":")
+        ns = NSM.store.namespace(prefix)
+        if ns is not None:
+            value = URIRef(f"{ns}{reference}")
+    if isinstance(value, URIRef):
+        value = SPEC_IRIS.setdefault(value, value)
+    return value
+
+
+def resolve_uris(spec: dict) -> None:
+    """Resolve the IRIs and CURIEs in a spec in place, except in templates
+
+    Walks the spec with a stack rather than recursively, and resolves each
+    distinct string only once. The results depend on the prefixes bound
+    at the time, so they are only reused within a call.
+    """
+    resolved = {}
+    stack = [spec]
+    while stack:
+        item = stack.pop()
+        # replacing values doesn't resize a dict, so it can be done mid loop
+        entries = item.items() if type(item) is dict else enumerate(item)
+        for k, value in entries:
+            if k == "template":
+                continue
+            # parsed YAML only holds plain dicts, lists and strs, so one exact
+            # type lookup sorts them from scalars and already resolved URIRefs
+            kind = type(value)
+            if kind is dict or kind is list:
+                stack.append(value)
+            elif kind is str:
+                if value not in resolved:
+                    resolved[value] = resolve_str(value)
+                item[k] = resolved[value]
+
+
+def digest(data: bytes) -> bytes:
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+def is_unchanged(digests: dict[Path, bytes]) -> bool:
+    """Whether the files still have the given digests"""
+    try:
+        return all(digest(path.read_bytes()) == d for path, d in digests.items())
+    except OSError:
+        return False
+
+
+def copy_containers(value):
+    """Copy the dicts and lists of a parsed spec
+
+    Unlike deepcopy everything else is shared, so the URIRefs stay the
+    interned SPEC_IRIS objects.
+    """
+    if isinstance(value, dict):
+        return {k: copy_containers(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [copy_containers(v) for v in value]
+    return value
+
+
+@timer
+def parse_config_from_yaml(
+    spec: Path, imported: bool = False, importers: tuple[Path, ...] = ()
+) -> dict:
+    logging.debug(f"Parsing config from {spec.name}")
+    path = spec.resolve()
+    if path in importers:
+        raise ValueError(f"{spec.name} imports itself via {importers[-1].name}")
+    # the same spec can be imported by more than one parent, its result
+    # depends on the bound prefixes and the contents of it and every spec it
+    # imports, directly or not
+    namespaces = tuple(NSM.namespaces())
+    key = (path, namespaces)
+    if imported and key in IMPORTED_SPECS and is_unchanged(IMPORTED_SPECS[key][1]):
+        return copy_containers(IMPORTED_SPECS[key][0])
+    data = spec.read_bytes()
+    digests = {path: digest(data)}
+    try:
+        this_spec = yaml.load(data, Loader=YAML_LOADER)
+    except yaml.YAMLError as e:
+        logging.error(f"Error loading {spec.name}: {e}")
+
+    v = IMPORTED_SPEC_VALIDATOR if imported else SPEC_VALIDATOR
     if not v.validate(this_spec):
         raise cerberus.DocumentError(f"Could not validate {spec.name}: {v.errors}")
     this_spec = v.normalized(this_spec)
@@ -102,7 +397,10 @@ def parse_config_from_yaml(spec: Path, imported: bool = False) -> dict:
     if this_spec["imports"]:
         for item in this_spec["imports"]:
             subspec_path = resolve_path(item, spec)
-            subspec = parse_config_from_yaml(subspec_path, imported=True)
+            subspec = parse_config_from_yaml(
+                subspec_path, imported=True, importers=(*importers, path)
+            )
+            digests.update(IMPORTED_SPECS[(subspec_path, namespaces)][1])
             merged_spec = merge(base=merged_spec, new=subspec)
     merged_spec = merge(base=merged_spec, new=this_spec)
 
@@ -122,37 +420,9 @@ def parse_config_from_yaml(spec: Path, imported: bool = False) -> dict:
     if merged_spec.get("prefixes") and not imported:
         for ns, uri in merged_spec["prefixes"].items():
             NSM.bind(ns, uri.strip("<>"))
-        prefixes = ""
-        for ns, uri in NSM.namespaces():
-            prefixes += f"@prefix {ns}: <{uri}> .\n"
-        merged_spec["prefixes"] = prefixes
-
-    def resolve_uris(item):
-        if isinstance(item, dict):
-            for k, v in item.items():
-                if not k == "template":
-                    item[k] = resolve_uris(v)
-            return item
-        elif isinstance(item, list):
-            for i in range(len(item)):
-                item[i] = resolve_uris(item[i])
-            return item
-        elif isinstance(item, str):
-            x = item.strip("<>")
-            if x.startswith("http"):
-                try:
-                    item = URIRef(x)
-                    item.n3()
-                except Exception:
-                    pass
-            else:
-                try:
-                    item = NSM.expand_curie(x)
-                except ValueError:
-                    pass
-            return item
-        else:
-            return item
+        merged_spec["prefixes"] = "".join(
+            f"@prefix {ns}: <{uri}> .\n" for ns, uri in NSM.namespaces()
+        )
 
     resolve_uris(merged_spec)
     if merged_spec.get("columns"):
@@ -165,41 +435,20 @@ def parse_config_from_yaml(spec: Path, imported: bool = False) -> dict:
         merged_spec["templateFunctions"] = resolve_path(
             merged_spec["templateFunctions"], spec
         )
+    if imported:
+        IMPORTED_SPECS[key] = (copy_containers(merged_spec), digests)
     return merged_spec
 
 
-@functools.lru_cache(maxsize=128)
 def replace_curly_terms(text) -> str:
-    # Find and replace {something} with {{ r['something'] }} except for Jinja tags
-    def repl(match):
-        inner = match.group(1)
-        return f"{{{{ r['{inner}'] }}}}"
+    """Rewrite {column} placeholders as jinja lookups on the row
 
-    # Match single curly braces that are NOT for Jinja-like {% ... %} tags
-    pattern = r"(?<!\{)\{(?!%)([^{}]+?)(?<!%)\}(?!\})"
-    return re.sub(pattern, repl, text)
+    Only runs once per template, the result is compiled and cached by the
+    caller. Jinja's own {{ ... }} and {% ... %} tags are left as they are.
+    """
+    # Find and replace {something} with {{ r['something'] }} except for Jinja tags
+    return CURLY_TERM_PATTERN.sub(CURLY_TERM_REPLACEMENT, text)
 
 
 def counter(start: int = 1, step: int = 1) -> Iterator[int]:
-    i = start
-    while True:
-        yield i
-        i += step
-    return StopIteration
-
-
-def approx_size_of(x: object) -> float:
-    """Return the approximate size of an object in mebibytes
-
-    Measures the length in bytes of the pickled object divided by 3*
-    then converted to mebibytes.
-
-    It is only approximate and can vary significantly depending on the
-    structure of the object.
-
-    *3 is arbritary but based on experience. mileage may vary.
-    """
-    p = pickle.dumps(x)
-    bites = len(p)
-    mebibytes = math.floor(bites / 3 / 1024 / 1024)
-    return mebibytes
+    return itertools.count(start, step)
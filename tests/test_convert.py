@@ -0,0 +1,219 @@
+from multiprocessing import Process, Queue
+
+import pytest
+from rdflib import XSD, Dataset, Graph, Literal, URIRef
+
+from rdfcon.convert import (
+    check_column_terms,
+    convert,
+    get_column_positions,
+    queue_chunk,
+    serialize_chunks,
+    templated_expressions,
+    warn_about_unused_columns,
+)
+from rdfcon.utils import parse_config_from_yaml
+
+
+def test_constant_templates_are_cached_per_prefixes():
+    template = "x:a x:b x:c ."
+    for ns in ("https://one.example.org/", "https://two.example.org/"):
+        spec = {"template": template, "prefixes": f"@prefix x: <{ns}> .\n"}
+        g = templated_expressions(headers=[], row=[], spec=spec)
+        assert set(g) == {(URIRef(ns + "a"), URIRef(ns + "b"), URIRef(ns + "c"))}
+
+
+def test_duplicate_headers_refer_to_the_first_column():
+    spec = {"template": '<https://example.org/{id}> <https://example.org/p> "{v}" .'}
+    g = templated_expressions(headers=["id", "v", "v"], row=["1", "a", "b"], spec=spec)
+    assert {str(o) for o in g.objects()} == {"a"}
+
+
+def test_duplicate_headers_map_to_the_first_column_position():
+    spec = {"columns": [{"column": "v"}, {"column": "id"}]}
+    assert get_column_positions(headers=["id", "v", "v"], spec=spec) == [1, 0]
+
+
+def test_unresolved_column_terms_are_reported():
+    with pytest.raises(ValueError, match="Predicate foo:name must be an rdflib term"):
+        check_column_terms({"columns": [{"predicate": "foo:name"}]})
+    with pytest.raises(ValueError, match="Object Thing must be an rdflib term"):
+        check_column_terms({"types": ["Thing"]})
+    check_column_terms(
+        {
+            "types": [URIRef("https://example.org/Thing")],
+            "columns": [{"predicate": URIRef("https://example.org/name")}],
+        }
+    )
+
+
+def test_graph_specs_convert_to_nquads(tmp_path):
+    (tmp_path / "data.csv").write_text("id,name\n1,a\n2,b\n")
+    spec_path = tmp_path / "spec.yaml"
+    spec_path.write_text(
+        "infile: data.csv\n"
+        "graph: urn:ex:g\n"
+        "fastSerialize: true\n"
+        "identifier: id\n"
+        "namespace: <https://example.org/pid/>\n"
+        "columns:\n"
+        "  - column: name\n"
+        "    predicate: <https://example.org/name>\n"
+    )
+    convert(spec=parse_config_from_yaml(spec_path), limit=0, processes=1)
+    ds = Dataset()
+    ds.parse(tmp_path / "data-1.nq", format="nquads")
+    assert set(ds.quads()) == {
+        (
+            URIRef(f"https://example.org/pid/{id}"),
+            URIRef("https://example.org/name"),
+            Literal(name, datatype=XSD.string),
+            URIRef("urn:ex:g"),
+        )
+        for id, name in (("1", "a"), ("2", "b"))
+    }
+
+
+def test_graph_specs_convert_to_trig_with_oxigraph(tmp_path):
+    pytest.importorskip("oxrdflib")
+    (tmp_path / "data.csv").write_text("id,name\n1,a\n")
+    spec_path = tmp_path / "spec.yaml"
+    spec_path.write_text(
+        "infile: data.csv\n"
+        "graph: urn:ex:g\n"
+        "identifier: id\n"
+        "namespace: <https://example.org/pid/>\n"
+        "columns:\n"
+        "  - column: name\n"
+        "    predicate: <https://example.org/name>\n"
+    )
+    convert(
+        spec=parse_config_from_yaml(spec_path),
+        limit=0,
+        processes=1,
+        store="oxigraph",
+    )
+    ds = Dataset()
+    ds.parse(tmp_path / "data-1.trig", format="trig")
+    assert set(ds.quads()) == {
+        (
+            URIRef("https://example.org/pid/1"),
+            URIRef("https://example.org/name"),
+            # oxigraph leaves xsd:string implicit
+            Literal("a"),
+            URIRef("urn:ex:g"),
+        )
+    }
+
+
+NT = (
+    b'<https://example.org/pid/1> <https://example.org/name> "a" .\n'
+    b'<https://example.org/pid/2> <https://example.org/name> "b" .\n'
+)
+
+
+def test_serialize_chunks_writes_each_chunk(tmp_path):
+    queue = Queue()
+    queue.put((NT, None, tmp_path / "data-1.ttl", "turtle"))
+    queue.put((NT, URIRef("urn:ex:g"), tmp_path / "data-1.trig", "trig"))
+    queue.put(None)
+    serialize_chunks(queue, [("ex", URIRef("https://example.org/"))])
+    turtle = (tmp_path / "data-1.ttl").read_text()
+    assert "@prefix ex: <https://example.org/> ." in turtle
+    assert set(Graph().parse(data=turtle, format="turtle")) == set(
+        Graph().parse(data=NT, format="nt")
+    )
+    ds = Dataset()
+    ds.parse(tmp_path / "data-1.trig", format="trig")
+    assert {g for *_, g in ds.quads()} == {URIRef("urn:ex:g")}
+    assert {(s, p, o) for s, p, o, _ in ds.quads()} == set(
+        Graph().parse(data=NT, format="nt")
+    )
+
+
+def test_streamed_chunks_are_appended_in_order(tmp_path):
+    queue = Queue(maxsize=2)
+    serializer = Process(target=serialize_chunks, args=(queue, []), daemon=True)
+    serializer.start()
+    destination = tmp_path / "data-1.nq"
+    for line in NT.splitlines(keepends=True):
+        count = queue_chunk(
+            queue, serializer, [line], "urn:ex:g", destination, "nquads"
+        )
+        assert count == 1
+    queue.put(None)
+    serializer.join(timeout=30)
+    assert serializer.exitcode == 0
+    assert destination.read_bytes() == NT.replace(b" .\n", b" <urn:ex:g> .\n")
+
+
+def test_unused_columns_are_warned_about(caplog):
+    spec = {
+        "identifier": "id",
+        "columns": [{"column": "name"}],
+        "template": '<https://example.org/{id}> <https://example.org/p> "{{ r["note"] }}" .',
+    }
+    headers = ["id", "name", "note", "extra"]
+    warn_about_unused_columns(headers=headers, spec=spec, filename="data.csv")
+    assert caplog.messages == ["data.csv contains 1 unmapped columns: {'extra'}"]
+    caplog.clear()
+    spec["columns"].append({"column": "extra"})
+    warn_about_unused_columns(headers=headers, spec=spec, filename="data.csv")
+    assert caplog.messages == []
+
+
+def test_threads_convert_the_same_as_processes(tmp_path):
+    (tmp_path / "data.csv").write_text(
+        "id,name,date\n"
+        + "".join(f"{i},n{i},0{i % 9 + 1}/01/2024\n" for i in range(100))
+    )
+    spec_path = tmp_path / "spec.yaml"
+    spec_path.write_text(
+        "infile: data.csv\n"
+        "fastSerialize: true\n"
+        "identifier: id\n"
+        "namespace: <https://example.org/pid/>\n"
+        "columns:\n"
+        "  - column: date\n"
+        "    predicate: <https://example.org/date>\n"
+        "    datatype: <http://www.w3.org/2001/XMLSchema#date>\n"
+        '    datestr: "%d/%m/%Y"\n'
+        "template: |-\n"
+        '  <https://example.org/pid/{id}> <https://example.org/name> "{name}" .\n'
+    )
+    graphs = []
+    for threads in (False, True):
+        convert(
+            spec=parse_config_from_yaml(spec_path),
+            limit=0,
+            processes=2,
+            threads=threads,
+        )
+        graphs.append(Graph().parse(tmp_path / "data-1.nt", format="nt"))
+    assert len(graphs[0]) == 200
+    assert set(graphs[0]) == set(graphs[1])
+
+
+def test_templates_drop_empty_values_and_empty_blank_nodes():
+    spec = {
+        "prefixes": "@prefix ex: <https://example.org/> .\n",
+        "template": (
+            'ex:{id} ex:name "{name}" ;\n'
+            '    ex:note "{note}" ;\n'
+            "    ex:link <{link}> ;\n"
+            "    ex:kind ex:{kind} ;\n"
+            '    ex:outer [ ex:inner [ ex:value "{note}" ] ] .\n'
+        ),
+    }
+    g = templated_expressions(
+        headers=["id", "name", "note", "link", "kind"],
+        row=["1", "a", "", "", ""],
+        spec=spec,
+    )
+    assert set(g) == {
+        (
+            URIRef("https://example.org/1"),
+            URIRef("https://example.org/name"),
+            Literal("a"),
+        )
+    }
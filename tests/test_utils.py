@@ -0,0 +1,206 @@
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+from rdflib import URIRef
+
+from rdfcon import utils
+from rdfcon.utils import (
+    estimate_rows,
+    get_date_parser,
+    merge,
+    parse_config_from_yaml,
+    read_csv,
+)
+
+
+def write_spec(path: Path, text: str) -> Path:
+    path.write_text(text)
+    return path
+
+
+def parse_or_error(parse, value: str):
+    try:
+        return parse(value)
+    except ValueError:
+        return ValueError
+
+
+def test_merge_keeps_nested_keys_from_base():
+    base = {"prefixes": {"a": "<https://a.org/>"}, "infile": "a.csv"}
+    new = {"prefixes": {"b": "<https://b.org/>"}}
+    merged = merge(base=base, new=new)
+    assert merged is base
+    assert merged == {
+        "prefixes": {"a": "<https://a.org/>", "b": "<https://b.org/>"},
+        "infile": "a.csv",
+    }
+
+
+def test_merge_empty_values_dont_override():
+    base = {"graph": "ex:graph", "types": ["ex:Thing"], "prefixes": {"a": "x"}}
+    new = {"graph": None, "types": [], "prefixes": {"a": ""}}
+    assert merge(base=base, new=new) == {
+        "graph": "ex:graph",
+        "types": ["ex:Thing"],
+        "prefixes": {"a": "x"},
+    }
+
+
+def test_merge_later_values_override():
+    base = {"graph": "ex:one", "prefixes": {"a": "<https://a.org/>"}}
+    new = {"graph": "ex:two", "prefixes": {"a": "<https://a2.org/>"}}
+    assert merge(base=base, new=new) == {
+        "graph": "ex:two",
+        "prefixes": {"a": "<https://a2.org/>"},
+    }
+
+
+def test_imported_prefixes_are_merged_with_the_importers(tmp_path):
+    (tmp_path / "data.csv").write_text("id,name\n1,a\n")
+    write_spec(
+        tmp_path / "sub.yaml",
+        "prefixes:\n  mergesub: <https://sub.example.org/>\n"
+        "types:\n  - mergesub:Thing\n",
+    )
+    spec = parse_config_from_yaml(
+        write_spec(
+            tmp_path / "main.yaml",
+            "imports:\n  - sub.yaml\n"
+            "prefixes:\n  mergemain: <https://main.example.org/>\n"
+            "infile: data.csv\n"
+            "template: |-\n  mergemain:{id} a mergesub:Thing .\n",
+        )
+    )
+    assert "@prefix mergesub: <https://sub.example.org/> .\n" in spec["prefixes"]
+    assert "@prefix mergemain: <https://main.example.org/> .\n" in spec["prefixes"]
+    assert spec["types"] == [URIRef("https://sub.example.org/Thing")]
+
+
+def test_circular_imports_raise(tmp_path):
+    (tmp_path / "data.csv").write_text("id,name\n1,a\n")
+    write_spec(tmp_path / "a.yaml", "imports:\n  - b.yaml\n")
+    write_spec(tmp_path / "b.yaml", "imports:\n  - a.yaml\n")
+    main = write_spec(
+        tmp_path / "main.yaml", "imports:\n  - a.yaml\ninfile: data.csv\n"
+    )
+    with pytest.raises(ValueError, match="a.yaml imports itself via b.yaml"):
+        parse_config_from_yaml(main)
+
+
+def test_read_csv_paths_agree(tmp_path, monkeypatch):
+    pytest.importorskip("polars")
+    infile = tmp_path / "data.csv"
+    infile.write_bytes(
+        b'\xef\xbb\xbfid,name,name\r\n1,"line1\r\nline2",a\r\n2,b,c,extra\r\n'
+        b'3,"old\rmac",d\r\n'
+    )
+    with_polars = list(read_csv(infile, "utf-8"))
+    monkeypatch.setattr(utils, "pl", None)
+    without_polars = list(read_csv(infile, "utf-8"))
+    assert with_polars[0] == without_polars[0] == ["\ufeffid", "name", "name"]
+    width = len(with_polars[0])
+    assert with_polars[1:] == [row[:width] for row in without_polars[1:]]
+    assert with_polars[1:] == [
+        ["1", "line1\nline2", "a"],
+        ["2", "b", "c"],
+        ["3", "old\nmac", "d"],
+    ]
+
+
+def test_imported_specs_are_reparsed_when_a_nested_import_changes(tmp_path):
+    (tmp_path / "data.csv").write_text("id,name\n1,a\n")
+    write_spec(tmp_path / "mid.yaml", "imports:\n  - leaf.yaml\n")
+    leaf = write_spec(tmp_path / "leaf.yaml", "types:\n  - <https://one.org/T>\n")
+    main = write_spec(
+        tmp_path / "main.yaml", "imports:\n  - mid.yaml\ninfile: data.csv\n"
+    )
+    assert parse_config_from_yaml(main)["types"] == [URIRef("https://one.org/T")]
+    leaf.write_text("types:\n  - <https://two.org/T>\n")
+    assert parse_config_from_yaml(main)["types"] == [URIRef("https://two.org/T")]
+
+
+def test_cached_imported_specs_share_interned_iris(tmp_path):
+    (tmp_path / "data.csv").write_text("id,name\n1,a\n")
+    write_spec(tmp_path / "sub.yaml", "types:\n  - <https://shared.org/T>\n")
+    main = write_spec(
+        tmp_path / "main.yaml", "imports:\n  - sub.yaml\ninfile: data.csv\n"
+    )
+    first = parse_config_from_yaml(main)
+    second = parse_config_from_yaml(main)
+    assert first["types"] is not second["types"]
+    assert first["types"][0] is second["types"][0]
+
+
+def test_iso_date_parsers_agree_with_strptime():
+    values = [
+        "2024-03-05",
+        "2024-3-5",
+        "2024-03-05T10:20",
+        "2024-03-05T10:20:30",
+        "2024-03-05 10:20",
+        "20240305",
+        "2024-02-30",
+        "2024-03-05T10:20:30+10:00",
+        "not a date",
+    ]
+    for datestr in ("%Y-%m-%d", "%Y-%m-%dT%H:%M", "%Y-%m-%dT%H:%M:%S"):
+        parse = get_date_parser(datestr)
+        for value in values:
+            expected = parse_or_error(lambda v: datetime.strptime(v, datestr), value)
+            assert parse_or_error(parse, value) == expected, (datestr, value)
+
+
+def test_numeric_date_parsers_agree_with_strptime():
+    values = [
+        "05/03/2024",
+        "5/3/2024",
+        " 5/03/2024",
+        "31/02/2024",
+        "05/13/2024",
+        "05/03/24",
+        "05/03/69",
+        "05/03/68",
+        "05/03/2024 10:20:30",
+        "05/03/2024  9:05:07",
+        "05-03-2024",
+        "",
+    ]
+    for datestr in ("%d/%m/%Y", "%d/%m/%y", "%m/%d/%Y", "%d/%m/%Y %H:%M:%S"):
+        assert utils.compile_date_format(datestr) is not None
+        parse = get_date_parser(datestr)
+        for value in values:
+            expected = parse_or_error(lambda v: datetime.strptime(v, datestr), value)
+            assert parse_or_error(parse, value) == expected, (datestr, value)
+
+
+def test_other_date_formats_fall_back_to_strptime():
+    for datestr in ("%d %b %Y", "%Y%%%m", "%d/%m/%d"):
+        assert utils.compile_date_format(datestr) is None
+    parse = get_date_parser("%d %b %Y")
+    assert parse("05 Mar 2024") == datetime(2024, 3, 5)
+
+
+def test_estimate_rows_counts_small_files_exactly(tmp_path):
+    infile = tmp_path / "data.csv"
+    for text, rows in (("", 0), ("id\n", 1), ("id\n1\n2", 3), ("id\n1\n2\n", 3)):
+        infile.write_text(text)
+        assert estimate_rows(infile) == rows
+
+
+def test_estimate_rows_extrapolates_from_a_sample(tmp_path):
+    infile = tmp_path / "data.csv"
+    infile.write_text("ident,abc\n" + "".join(f"{i:05},abc\n" for i in range(1000)))
+    assert estimate_rows(infile, sample_size=1000) == 1001
+    assert estimate_rows(infile, sample_size=10) >= 1
+
+
+def test_imported_template_format_is_kept(tmp_path):
+    (tmp_path / "data.csv").write_text("id,name\n1,a\n")
+    write_spec(tmp_path / "sub.yaml", "templateFormat: nt\n")
+    main = write_spec(
+        tmp_path / "main.yaml",
+        "imports:\n  - sub.yaml\ninfile: data.csv\n"
+        'template: |-\n  <https://example.org/{id}> <https://example.org/p> "{name}" .\n',
+    )
+    assert parse_config_from_yaml(main)["templateFormat"] == "nt"